@@ -1,8 +1,13 @@
 import streamlit as st
-from qa_bot import get_answer
+from qa_bot import answer_question
 import os
+from collections import deque
 from dotenv import load_dotenv
 
+# Chat history limits
+MAX_HISTORY_MESSAGES = 100
+VISIBLE_MESSAGES = 20
+
 # Load environment variables
 load_dotenv()
 
@@ -14,7 +19,10 @@ st.set_page_config(
 )
 
 # Custom CSS
-st.markdown("""
+@st.cache_data
+def load_css() -> str:
+    """Return the custom page styles, built once and reused across reruns."""
+    return """
 <style>
     .stTextInput > div > div > input {
         background-color: #f0f2f6;
@@ -29,7 +37,9 @@ st.markdown("""
         font-family: 'Inter', sans-serif;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+st.markdown(load_css(), unsafe_allow_html=True)
 
 # Header
 st.title("🤖 Insurance QA Assistant")
@@ -41,12 +51,30 @@ Ask me anything about car insurance! I'm trained on Allstate's knowledge base an
 - Claims processes
 """)
 
-# Initialize session state
+@st.cache_data(ttl=3600, max_entries=1000, show_spinner=False)
+def cached_answer(question: str) -> str:
+    """Answer a question, reusing the result for repeated questions."""
+    # Exceptions are not cached, so failed requests are retried next time
+    return answer_question(question)
+
+def clear_chat():
+    """Clear the chat history before the next run renders it."""
+    st.session_state.messages = deque(maxlen=MAX_HISTORY_MESSAGES)
+
+# Initialize session state, the oldest messages are dropped once the limit is reached
 if "messages" not in st.session_state:
-    st.session_state.messages = []
+    st.session_state.messages = deque(maxlen=MAX_HISTORY_MESSAGES)
+
+# Display chat history, collapsing older messages into a single element
+messages = list(st.session_state.messages)
+older_messages = messages[:-VISIBLE_MESSAGES]
+if older_messages:
+    with st.expander(f"Older history ({len(older_messages)} messages)"):
+        st.markdown("\n\n".join(
+            f"**{message['role'].title()}:** {message['content']}" for message in older_messages
+        ))
 
-# Display chat history
-for message in st.session_state.messages:
+for message in messages[-VISIBLE_MESSAGES:]:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
@@ -62,7 +90,10 @@ if prompt := st.chat_input("Ask your insurance question..."):
     # Get bot response
     with st.chat_message("assistant"):
         with st.spinner("Thinking..."):
-            response = get_answer(prompt)
+            try:
+                response = cached_answer(prompt)
+            except Exception as e:
+                response = f"Error getting answer: {str(e)}"
             st.markdown(response)
     
     # Add assistant response to chat history
@@ -86,7 +117,5 @@ with st.sidebar:
     This is a demo application. For official insurance advice, please consult with an Allstate agent.
     """)
     
-    # Clear chat button
-    if st.button("Clear Chat"):
-        st.session_state.messages = []
-        st.experimental_rerun()
+    # Clear chat button, the callback runs before the rerun so no extra rerun is needed
+    st.button("Clear Chat", on_click=clear_chat)
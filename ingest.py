@@ -1,13 +1,33 @@
-import requests
-from bs4 import BeautifulSoup
-from typing import Dict, List, Set
+import asyncio
+import httpx
+import lxml.html
+from lxml import etree
+from lxml.cssselect import CSSSelector
+from typing import Dict, Iterable, List
 import pinecone
+from pinecone.grpc import PineconeGRPC
+import numpy as np
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
+import tiktoken
 import os
+import io
+import argparse
+from openai import OpenAI
 import time
 from dotenv import load_dotenv
 import json
+import logging
+import re
+import hashlib
+import diskcache
+import itertools
+from functools import lru_cache
+import atexit
+import multiprocessing
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from urllib.parse import urljoin, urlparse
 from selenium import webdriver
 from selenium.webdriver.firefox.service import Service
@@ -15,44 +35,102 @@ from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import WebDriverException
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Pinecone
-pc = pinecone.Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+# Configure logging, set the level to DEBUG for per-link and per-chunk output
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
 
 # Pinecone index configuration
 index_name = "insurance-articles"
-dimension = 1536  # OpenAI embedding dimension
-
-# Create index if it doesn't exist
-try:
-    index = pc.Index(index_name)
-    print(f"Connected to existing index: {index_name}")
-except Exception as e:
-    print(f"Index {index_name} not found, creating...")
-    pc.create_index(
-        name=index_name,
-        dimension=dimension,
-        metric="cosine",
-        spec=pinecone.ServerlessSpec(
-            cloud="aws",
-            region="us-east-1"
+dimension = 1536  # text-embedding-3-small dimension
+
+# Number of chunks sent per embedding request
+EMBED_BATCH_SIZE = 256
+
+# OpenAI limits the total number of tokens in one embeddings request
+MAX_EMBED_TOKENS_PER_BATCH = 250_000
+
+# OpenAI embedding model (must match the model used in qa_bot.py)
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# OpenAI Batch API settings used by --batch-mode, a batch file holds at most 50,000 requests
+BATCH_API_MAX_REQUESTS = 50_000
+BATCH_API_POLL_INTERVAL = 60  # seconds
+
+# Parallel upsert settings, async gRPC upserts are futures on one channel,
+# in-flight requests are capped to stay clear of Pinecone rate limits
+UPSERT_BATCH_SIZE = 100
+UPSERT_MAX_IN_FLIGHT = 5
+
+@lru_cache(maxsize=1)
+def get_pinecone():
+    """Return the shared Pinecone client."""
+    return PineconeGRPC(api_key=os.getenv("PINECONE_API_KEY"))
+
+@lru_cache(maxsize=1)
+def get_index():
+    """Return the shared Pinecone index, creating it if it doesn't exist."""
+    pc = get_pinecone()
+    # A known host lets the client connect without a describe_index round trip
+    host = os.getenv("PINECONE_INDEX_HOST")
+    if host:
+        return pc.Index(host=host)
+    
+    try:
+        index = pc.Index(index_name)
+        logger.info("Connected to existing index: %s", index_name)
+    except Exception as e:
+        logger.info("Index %s not found, creating...", index_name)
+        pc.create_index(
+            name=index_name,
+            dimension=dimension,
+            metric="cosine",
+            spec=pinecone.ServerlessSpec(
+                cloud="aws",
+                region="us-east-1"
+            )
         )
+        logger.info("Created new index: %s", index_name)
+        # Wait for index to be ready
+        while not pc.describe_index(index_name).status["ready"]:
+            time.sleep(1)
+        index = pc.Index(index_name)
+    return index
+
+@lru_cache(maxsize=1)
+def get_embeddings():
+    """Return the shared OpenAI embeddings client."""
+    return OpenAIEmbeddings(
+        model=EMBEDDING_MODEL,
+        chunk_size=EMBED_BATCH_SIZE,
+        openai_api_key=os.getenv("OPENAI_API_KEY")
     )
-    print(f"Created new index: {index_name}")
-    # Wait for index to be ready
-    while not pc.describe_index(index_name).status["ready"]:
-        time.sleep(1)
-    index = pc.Index(index_name)
 
-# Initialize OpenAI embeddings
-embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+# Token-aware text splitter shared by every article, the tokenizer is loaded once at import
+TOKEN_ENCODING = "cl100k_base"
+CHUNK_SIZE = 512  # tokens
+tokenizer = tiktoken.get_encoding(TOKEN_ENCODING)
+text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+    encoding_name=TOKEN_ENCODING,
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=50
+)
 
 # Enable to not upload to Pinecone
 MOCK_UPLOAD = False
 
+# On-disk cache of chunk embeddings so re-runs only embed new or changed text
+embedding_cache = diskcache.Cache("./.embed_cache")
+
+# On-disk cache of fetched pages so re-runs within a day skip the network and the browser,
+# older static pages are revalidated with their ETag or Last-Modified date
+page_cache = diskcache.Cache("./.page_cache")
+PAGE_CACHE_TTL = 24 * 60 * 60  # seconds
+
 # Source configurations
 SOURCES = {
     "allstate": {
@@ -60,7 +138,8 @@ SOURCES = {
         "article_patterns": ["/resources/car-insurance/"],
         "excluded_terms": ["quote", "bundle", "calculator", "español", "moving", "disaster", "flood"],
         "content_selectors": ["#main-content [class*='content']", "#main-content [class*='article']"],
-        "max_articles": 20
+        "max_articles": 20,
+        "requires_js": True
     },
     "progressive": {
         "base_urls": [
@@ -70,7 +149,8 @@ SOURCES = {
         "article_patterns": ["/answers/", "/learn/"],
         "excluded_terms": ["quote", "bundle", "calculator", "español"],
         "content_selectors": [".main-content", ".article-content"],
-        "max_articles": 20
+        "max_articles": 20,
+        "requires_js": False
     },
     "auto-owners": {
         "base_urls": [
@@ -80,10 +160,192 @@ SOURCES = {
         "article_patterns": ["/insurance/", "/resources/"],
         "excluded_terms": ["quote", "find-agent", "claims/report"],
         "content_selectors": [".content-area", ".article-content"],
-        "max_articles": 20
+        "max_articles": 20,
+        "requires_js": False
     }
 }
 
+# Whitespace normalization applied to extracted text before chunking
+INLINE_WHITESPACE_RE = re.compile(r"[^\S\n]+")
+LINE_BREAK_RE = re.compile(r"\s*\n\s*")
+
+# Pinecone rejects records with more than 40KB of metadata, keep the chunk text well below that
+MAX_METADATA_TEXT_BYTES = 32_000
+
+# Insurance line of each article, matched against its URL path and stored as metadata so
+# questions can be pre-filtered (must match the categories in qa_bot.py)
+# Terms shared between lines, like "property" in property damage liability, are left out
+CATEGORY_PATTERNS = {
+    "auto": re.compile(r"\b(?:car|cars|auto|automobile|vehicles?|drivers?|driving|motorcycles?|trucks?)\b", re.IGNORECASE),
+    "home": re.compile(r"\b(?:home|homes|homeowners?|house|renters?|condos?)\b", re.IGNORECASE),
+    "life": re.compile(r"\blife\b", re.IGNORECASE)
+}
+DEFAULT_CATEGORY = "general"
+
+# Generic selectors tried when none of a source's content selectors match
+FALLBACK_CONTENT_SELECTORS = ["article", "main", ".content", "#content"]
+
+# Precompile each source's URL filters so each link is checked with one regex scan per filter
+for config in SOURCES.values():
+    config["article_re"] = re.compile("|".join(map(re.escape, config["article_patterns"])))
+    config["excluded_re"] = re.compile("|".join(map(re.escape, config["excluded_terms"])), re.IGNORECASE)
+
+# Common browser user agent for both Selenium and plain HTTP requests
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+# Maximum number of concurrent static page requests, overall and to any one host
+STATIC_FETCH_CONCURRENCY = 10
+STATIC_FETCH_PER_HOST = 4
+
+# Static pages are parsed in threads, lxml releases the GIL while parsing. Only batches large
+# enough to repay starting worker processes, each of which re-imports this module, use a process pool
+PARSE_PROCESS_MIN_PAGES = 200
+PARSE_WORKERS = 4
+
+# Retries for static requests that fail to connect or hit a transient server error
+FETCH_RETRIES = 3
+FETCH_RETRY_BACKOFF = 0.3  # seconds, doubled after each attempt
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Number of pages rendered in parallel, each worker thread owns one browser that lives
+# for the whole run and is replaced after DRIVER_MAX_PAGES pages to bound its memory growth
+SCRAPE_WORKERS = 4
+DRIVER_MAX_PAGES = 50
+thread_drivers = threading.local()
+open_drivers = []
+open_drivers_lock = threading.Lock()
+
+# Page areas searched for article links, in addition to each source's content selectors
+LINK_AREA_SELECTORS = ["main", "[role='article']"]
+
+# Scrolls to the bottom of the page if it has lazy-loaded elements, returning whether it scrolled
+SCROLL_LAZY_CONTENT_SCRIPT = """
+if (!document.querySelector("[data-lazy], [data-src], [loading='lazy']")) return false;
+window.scrollTo(0, document.body.scrollHeight);
+return true;
+"""
+
+# Returns [href, text] for every element matching a selector in a single WebDriver call
+COLLECT_LINKS_SCRIPT = "return Array.from(document.querySelectorAll(arguments[0]), a => [a.href, a.innerText.trim()]);"
+
+def chunks(iterable, batch_size=100):
+    """Break an iterable into lists of at most batch_size items."""
+    it = iter(iterable)
+    chunk = list(itertools.islice(it, batch_size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(it, batch_size))
+
+def embedding_cache_key(text: str) -> str:
+    """Build the embedding cache key for a chunk of text."""
+    # Key on the model too so switching models never returns stale vectors, blake2b is
+    # faster than sha256 and 128 bits is plenty to tell chunks apart
+    return f"{EMBEDDING_MODEL}:{hashlib.blake2b(text.encode(), digest_size=16).hexdigest()}"
+
+def embed_with_cache(texts: List[str]) -> List[np.ndarray]:
+    """Embed texts, reusing cached vectors and embedding each distinct text only once."""
+    keys = [embedding_cache_key(text) for text in texts]
+    texts_by_key = dict(zip(keys, texts))
+    vectors = {key: embedding_cache.get(key) for key in texts_by_key}
+    missing = [key for key, vector in vectors.items() if vector is None]
+    
+    if missing:
+        # Convert the whole batch to one float32 array, which Pinecone stores and
+        # which takes a fraction of the memory of Python float lists
+        new_vectors = np.asarray(
+            get_embeddings().embed_documents([texts_by_key[key] for key in missing]),
+            dtype=np.float32
+        )
+        for key, vector in zip(missing, new_vectors):
+            embedding_cache.set(key, vector)
+            vectors[key] = vector
+    
+    logger.debug("Embedding cache hits: %d/%d distinct chunks (%d total)", len(vectors) - len(missing), len(vectors), len(texts))
+    # Fan vectors back out to every occurrence, duplicates across batches hit the cache
+    return [vectors[key] for key in keys]
+
+def embed_with_batch_api(texts: Iterable[str]):
+    """Embed uncached texts with the OpenAI Batch API and store the vectors in the embedding cache."""
+    texts_by_key = {embedding_cache_key(text): text for text in texts}
+    missing = [key for key in texts_by_key if key not in embedding_cache]
+    if not missing:
+        return
+    
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    for batch_keys in chunks(missing, BATCH_API_MAX_REQUESTS):
+        requests_jsonl = "".join(
+            json.dumps({
+                "custom_id": key,
+                "method": "POST",
+                "url": "/v1/embeddings",
+                "body": {"model": EMBEDDING_MODEL, "input": texts_by_key[key]}
+            }) + "\n"
+            for key in batch_keys
+        )
+        input_file = client.files.create(
+            file=("embeddings.jsonl", io.BytesIO(requests_jsonl.encode())),
+            purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/embeddings",
+            completion_window="24h"
+        )
+        logger.info("Submitted embedding batch %s with %d chunks", batch.id, len(batch_keys))
+        
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(BATCH_API_POLL_INTERVAL)
+            batch = client.batches.retrieve(batch.id)
+            logger.debug("Embedding batch %s: %s", batch.id, batch.status)
+        # Chunks without a result are left uncached and embedded directly during upload, so a
+        # failed or partly failed batch never aborts the ingest
+        if batch.status != "completed":
+            logger.error("Embedding batch %s %s, keeping any partial results", batch.id, batch.status)
+        
+        # Requests that failed are only written to the error file, which is all there is if every one failed
+        if batch.error_file_id is not None:
+            errors = client.files.content(batch.error_file_id).text.splitlines()
+            logger.warning("Embedding batch %s had %d failed requests, first error: %s", batch.id, len(errors), errors[0] if errors else "")
+        
+        embedded = 0
+        if batch.output_file_id is not None:
+            for line in client.files.content(batch.output_file_id).text.splitlines():
+                result = json.loads(line)
+                if result["error"] or result["response"]["status_code"] != 200:
+                    logger.warning("Embedding request %s failed: %s", result["custom_id"], result["error"] or result["response"]["body"])
+                    continue
+                vector = np.asarray(result["response"]["body"]["data"][0]["embedding"], dtype=np.float32)
+                embedding_cache.set(result["custom_id"], vector)
+                embedded += 1
+        logger.info("Embedding batch %s finished: %d/%d chunks embedded", batch.id, embedded, len(batch_keys))
+
+def page_cache_key(kind: str, url: str) -> str:
+    """Build the page cache key for a URL fetched statically or rendered in a browser."""
+    return f"{kind}:{hashlib.blake2b(url.encode()).hexdigest()}"
+
+def truncate_utf8(text: str, max_bytes: int) -> str:
+    """Truncate text to at most max_bytes when UTF-8 encoded."""
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode("utf-8", "ignore")
+
+def article_category(url: str) -> str:
+    """Return the insurance line of an article from its URL path."""
+    # Only the path is checked, domains like auto-owners.com say nothing about the article
+    path = urlparse(url).path
+    for category, pattern in CATEGORY_PATTERNS.items():
+        if pattern.search(path):
+            return category
+    return DEFAULT_CATEGORY
+
+def split_text(text: str) -> List[str]:
+    """Split text into chunks, keeping short texts as a single chunk."""
+    # A token is at least one character, so short texts always fit in one chunk
+    if len(text) <= CHUNK_SIZE:
+        return [text]
+    return text_splitter.split_text(text)
+
 def setup_driver():
     """Setup and return a configured Firefox WebDriver."""
     firefox_options = Options()
@@ -95,16 +357,79 @@ def setup_driver():
     firefox_options.set_preference("dom.webdriver.enabled", False)
     firefox_options.set_preference('useAutomationExtension', False)
     
+    # Skip assets that are not needed to read the page text
+    firefox_options.set_preference("permissions.default.image", 2)
+    firefox_options.set_preference("permissions.default.stylesheet", 2)
+    firefox_options.set_preference("gfx.downloadable_fonts.enabled", False)
+    firefox_options.set_preference("browser.sessionhistory.max_entries", 1)
+    firefox_options.set_preference("dom.ipc.plugins.enabled", False)
+    
+    # Return once the DOM is interactive, content is waited for explicitly
+    firefox_options.page_load_strategy = "eager"
+    
     # Add common user agent
-    firefox_options.set_preference('general.useragent.override', 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
+    firefox_options.set_preference('general.useragent.override', USER_AGENT)
     
     driver = webdriver.Firefox(options=firefox_options)
     driver.set_page_load_timeout(30)
     return driver
 
-def wait_for_page_load(driver, url):
-    """Wait for the page to fully load and render content."""
-    print(f"Loading {url}...")
+def get_driver():
+    """Return the WebDriver owned by the current thread, creating it on first use."""
+    driver = getattr(thread_drivers, "driver", None)
+    if driver is not None and thread_drivers.pages >= DRIVER_MAX_PAGES:
+        logger.debug("Recycling browser after %d pages", thread_drivers.pages)
+        discard_driver()
+        driver = None
+    
+    if driver is None:
+        logger.info("Setting up browser...")
+        driver = setup_driver()
+        thread_drivers.driver = driver
+        thread_drivers.pages = 0
+        with open_drivers_lock:
+            open_drivers.append(driver)
+    else:
+        driver.delete_all_cookies()
+    
+    thread_drivers.pages += 1
+    return driver
+
+def discard_driver():
+    """Quit the current thread's WebDriver so its next page starts a fresh browser."""
+    driver = getattr(thread_drivers, "driver", None)
+    if driver is None:
+        return
+    
+    thread_drivers.driver = None
+    with open_drivers_lock:
+        if driver in open_drivers:
+            open_drivers.remove(driver)
+    try:
+        driver.quit()
+    except Exception as e:
+        logger.warning("Error closing browser: %s", e)
+
+def quit_drivers():
+    """Quit every WebDriver created by the scraping threads."""
+    with open_drivers_lock:
+        while open_drivers:
+            driver = open_drivers.pop()
+            try:
+                driver.quit()
+            except Exception as e:
+                logger.warning("Error closing browser: %s", e)
+
+atexit.register(quit_drivers)
+
+@lru_cache(maxsize=1)
+def get_scrape_executor() -> ThreadPoolExecutor:
+    """Return the worker threads that render pages, shared by every source so their browsers are reused."""
+    return ThreadPoolExecutor(max_workers=SCRAPE_WORKERS)
+
+def wait_for_page_load(driver, url, wait_selector=None):
+    """Wait for the page to load and for the elements matching wait_selector to render."""
+    logger.debug("Loading %s...", url)
     driver.get(url)
     
     # Wait for initial page load
@@ -112,7 +437,7 @@ def wait_for_page_load(driver, url):
         EC.presence_of_element_located((By.TAG_NAME, "body"))
     )
     
-    print("Initial page load complete, waiting for content...")
+    logger.debug("Initial page load complete, waiting for content...")
     
     # Wait for potential overlay/loading elements to disappear
     try:
@@ -120,262 +445,519 @@ def wait_for_page_load(driver, url):
             EC.presence_of_element_located((By.CSS_SELECTOR, "[class*='loading'], [class*='overlay']"))
         )
     except:
-        print("No loading overlay found or timeout waiting for it to disappear")
+        logger.debug("No loading overlay found or timeout waiting for it to disappear")
     
-    # Additional wait for dynamic content
-    time.sleep(5)
+    # Scroll to bottom to trigger lazy loading, only when the page has lazy-loaded elements
+    scrolled = driver.execute_script(SCROLL_LAZY_CONTENT_SCRIPT)
     
-    # Scroll to bottom to trigger lazy loading
-    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-    time.sleep(2)
+    # Wait for the elements we are going to read instead of a fixed delay
+    if wait_selector:
+        try:
+            WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, wait_selector))
+            )
+        except Exception:
+            logger.debug("Timeout waiting for content elements")
     
     # Scroll back to top
-    driver.execute_script("window.scrollTo(0, 0);")
+    if scrolled:
+        driver.execute_script("window.scrollTo(0, 0);")
     
-    print("Page fully loaded")
+    logger.debug("Page fully loaded")
 
-def get_article_urls(source_config: dict, base_url: str) -> set:
-    """Collect article URLs from a base page based on source configuration."""
-    article_urls = set()
-    try:
-        driver = setup_driver()
+def link_selector(source_config: dict) -> str:
+    """Build one CSS selector matching the links of every content area of a source."""
+    area_selectors = LINK_AREA_SELECTORS + source_config.get("content_selectors", [])
+    return ", ".join(f"{selector} a" for selector in area_selectors)
+
+def _iter_candidate_links(links: List[tuple], source_config: dict, base_url: str):
+    """Yield matching article URLs from (href, text) pairs in discovery order, without duplicates."""
+    logger.debug("Found %d potential links", len(links))
+    
+    # Skip per-link log calls entirely unless debug output is enabled
+    verbose = logger.isEnabledFor(logging.DEBUG)
+    seen = set()
+    # Bind per-source lookups once rather than for every link
+    base_netloc = urlparse(base_url).netloc
+    matches_article = source_config["article_re"].search
+    matches_excluded = source_config["excluded_re"].search
+    for href, text in links:
+        if not href or not text:
+            continue
         
-        print(f"\n=== Fetching from {base_url} ===")
-        wait_for_page_load(driver, base_url)
+        # Skip non-http links
+        if not href.startswith("http"):
+            continue
         
-        # Get page title for debugging
-        print(f"\nPage Title: {driver.title}\n")
+        # Ensure link is from the same domain
+        if urlparse(href).netloc != base_netloc:
+            continue
         
-        if "Access Denied" in driver.title or "Security Check" in driver.page_source:
-            print("WARNING: Possible security check or access denied page")
-            print("Page source preview:")
-            print(driver.page_source[:500])
-            return article_urls
+        if verbose:
+            logger.debug("Evaluating link: %s (%s)", text, href)
         
-        print("Looking for article links...")
+        # Check if URL matches any of the article patterns
+        if not matches_article(href):
+            if verbose:
+                logger.debug("Skipping: Does not match article patterns")
+            continue
         
-        # Try multiple strategies to find content areas
-        content_areas = []
+        # Check for excluded terms
+        if matches_excluded(href):
+            if verbose:
+                logger.debug("Skipping: Contains excluded term")
+            continue
         
-        # Strategy 1: Main content area
-        try:
-            main_content = driver.find_element(By.TAG_NAME, "main")
-            if main_content:
-                print("Found main content area")
-                content_areas.append(main_content)
-        except Exception as e:
-            print(f"No main content area found: {str(e)}")
+        if href in seen:
+            if verbose:
+                logger.debug("Skipping: Duplicate article")
+            continue
         
-        # Strategy 2: Article containers by role
-        try:
-            article_elements = driver.find_elements(By.CSS_SELECTOR, "[role='article']")
-            if article_elements:
-                print(f"Found {len(article_elements)} article elements by role")
-                content_areas.extend(article_elements)
-        except Exception as e:
-            print(f"No article elements found by role: {str(e)}")
+        if verbose:
+            logger.debug("Adding article to collection")
+        seen.add(href)
+        yield href
+
+def select_article_urls(links: List[tuple], source_config: dict, base_url: str) -> Dict[str, None]:
+    """Filter (href, text) pairs down to at most max_articles article URLs, keyed in discovery order."""
+    # Stop filtering links as soon as the article limit is reached
+    max_articles = source_config["max_articles"]
+    article_urls = dict.fromkeys(
+        itertools.islice(_iter_candidate_links(links, source_config, base_url), max_articles)
+    )
+    if len(article_urls) >= max_articles:
+        logger.info("Reached maximum article limit (%d)", max_articles)
+    
+    logger.info("Found %d relevant articles on %s", len(article_urls), base_url)
+    return article_urls
+
+def get_static_article_urls(source_config: dict, base_url: str, html: bytes) -> Dict[str, None]:
+    """Collect article URLs from the server-rendered HTML of a base page."""
+    if html is None:
+        return {}
+    
+    tree = parse_html(html)
+    tree.make_links_absolute(base_url)
+    anchors = tree.cssselect(link_selector(source_config)) or tree.cssselect("body a")
+    links = [(anchor.get("href"), " ".join(anchor.text_content().split())) for anchor in anchors]
+    return select_article_urls(links, source_config, base_url)
+
+def collect_rendered_article_urls(source_config: dict, base_url: str) -> Dict[str, None]:
+    """Collect article URLs with the current worker thread's browser."""
+    article_urls = {}
+    try:
+        driver = get_driver()
+        wait_for_page_load(driver, base_url, link_selector(source_config))
         
-        # Strategy 3: Source-specific content selectors
-        for selector in source_config.get("content_selectors", []):
-            try:
-                elements = driver.find_elements(By.CSS_SELECTOR, selector)
-                if elements:
-                    print(f"Found {len(elements)} elements using selector: {selector}")
-                    content_areas.extend(elements)
-            except Exception as e:
-                continue
+        # Get page title for debugging
+        logger.debug("Page Title: %s", driver.title)
         
-        if not content_areas:
-            print("No content areas found with primary strategies, falling back to page scan")
-            content_areas = [driver.find_element(By.TAG_NAME, "body")]
+        if "Access Denied" in driver.title or "Security Check" in driver.page_source:
+            logger.warning("Possible security check or access denied page, source preview: %s", driver.page_source[:500])
+            return article_urls
         
-        print(f"\nTotal content areas to search: {len(content_areas)}")
+        logger.debug("Looking for article links...")
         
-        # Process each content area
-        for area_idx, content_area in enumerate(content_areas, 1):
-            print(f"\nSearching content area {area_idx}/{len(content_areas)}")
-            
-            # Look for any links
-            try:
-                links = content_area.find_elements(By.TAG_NAME, "a")
-                if links:
-                    print(f"Found {len(links)} potential links")
-                    
-                    for link in links:
-                        if len(article_urls) >= source_config["max_articles"]:
-                            print(f"\nReached maximum article limit ({source_config['max_articles']})")
-                            return article_urls
-                        
-                        href = link.get_attribute("href")
-                        text = link.text.strip()
-                        
-                        if not href or not text:
-                            continue
-                        
-                        # Skip non-http links
-                        if not href.startswith("http"):
-                            continue
-                        
-                        # Ensure link is from the same domain
-                        if not urlparse(href).netloc == urlparse(base_url).netloc:
-                            continue
-                        
-                        print(f"\nEvaluating link:")
-                        print(f"Text: {text}")
-                        print(f"URL: {href}")
-                        
-                        # Check if URL matches any of the article patterns
-                        if not any(pattern in href for pattern in source_config["article_patterns"]):
-                            print("Skipping: Does not match article patterns")
-                            continue
-                        
-                        # Check for excluded terms
-                        if any(term in href.lower() for term in source_config["excluded_terms"]):
-                            print(f"Skipping: Contains excluded term")
-                            continue
-                        
-                        if href in article_urls:
-                            print("Skipping: Duplicate article")
-                            continue
-                        
-                        print("✓ Adding article to collection")
-                        article_urls.add(href)
-                        
-            except Exception as e:
-                print(f"Error processing links: {str(e)}")
-                continue
+        # Query the links of every content area with one combined selector
+        links = driver.execute_script(COLLECT_LINKS_SCRIPT, link_selector(source_config))
+        if not links:
+            logger.debug("No links found in content areas, falling back to page scan")
+            links = driver.execute_script(COLLECT_LINKS_SCRIPT, "body a")
         
-        print(f"\nFound {len(article_urls)} relevant articles")
+        article_urls = select_article_urls(links, source_config, base_url)
         
+    except WebDriverException as e:
+        # The browser may be left in a broken state, replace it for the next page
+        logger.error("Browser error fetching article URLs: %s", e)
+        discard_driver()
     except Exception as e:
-        print(f"Error fetching article URLs: {str(e)}")
-    finally:
-        driver.quit()
+        logger.error("Error fetching article URLs: %s", e)
     
     return article_urls
 
-def scrape_article(url: str, source_config: dict) -> Dict:
-    """Scrape a single article page using Selenium to handle dynamic content."""
-    print(f"\n=== Processing article: {url} ===")
+def harvest_article_urls(base_pages: List[tuple]) -> List[Dict[str, None]]:
+    """Collect the article URLs of every (source_config, base_url) page, keyed in discovery order."""
+    # Index pages are mostly server-rendered, so even sources whose articles need a browser
+    # get their links over plain HTTP, with every base page fetched concurrently
+    pages_html = asyncio.run(fetch_pages([base_url for _, base_url in base_pages]))
+    
+    harvested = []
+    for (source_config, base_url), html in zip(base_pages, pages_html):
+        article_urls = get_static_article_urls(source_config, base_url, html)
+        if not article_urls:
+            # Render the page on a scrape worker so one of the pooled browsers is used
+            logger.info("No article links in static HTML of %s, falling back to browser rendering", base_url)
+            article_urls = get_scrape_executor().submit(collect_rendered_article_urls, source_config, base_url)
+        harvested.append(article_urls)
+    
+    # Wait for the browser fallbacks, which render in parallel
+    return [urls.result() if isinstance(urls, Future) else urls for urls in harvested]
+
+def parse_html(html):
+    """Parse page HTML with lxml, dropping script and style elements."""
+    tree = lxml.html.fromstring(html)
+    for element in tree.xpath("//script | //style | //noscript"):
+        element.drop_tree()
+    return tree
+
+def normalize_text(text: str) -> str:
+    """Collapse runs of whitespace while keeping line breaks."""
+    return LINE_BREAK_RE.sub("\n", INLINE_WHITESPACE_RE.sub(" ", text)).strip()
+
+@lru_cache(maxsize=None)
+def compile_text_query(selectors: tuple) -> etree.XPath:
+    """Compile a group of CSS selectors into one XPath query for the text inside every match."""
+    # A node-set union has no duplicates, so text inside nested matches is only returned once
+    element_path = CSSSelector(", ".join(selectors), translator="html").path
+    return etree.XPath(f"({element_path})//text()", smart_strings=False)
+
+def extract_text(tree, selectors: List[str]) -> str:
+    """Join the text of every element matching the given CSS selectors."""
+    # One XPath evaluation in libxml2 returns every text node in document order
+    parts = compile_text_query(tuple(selectors))(tree)
+    return normalize_text(" ".join(filter(None, map(str.strip, parts))))
+
+def parse_static_article(url: str, html: bytes, source_config: dict) -> Dict:
+    """Extract an article from server-rendered HTML, returning None if it has no content."""
+    tree = parse_html(html)
+    
+    # Try source-specific content selectors first, then common fallbacks
+    content = extract_text(tree, source_config["content_selectors"])
+    if not content:
+        content = extract_text(tree, FALLBACK_CONTENT_SELECTORS)
+    if not content:
+        return None
+    
+    return {
+        "url": url,
+        "title": (tree.findtext(".//title") or "").strip(),
+        "content": content
+    }
+
+@lru_cache(maxsize=1)
+def get_parse_executor() -> ProcessPoolExecutor:
+    """Return the process pool that parses large batches of static pages, created on first use."""
+    # Spawn rather than fork, the gRPC channel may already be open in this process
+    executor = ProcessPoolExecutor(
+        max_workers=min(PARSE_WORKERS, os.cpu_count() or 1),
+        mp_context=multiprocessing.get_context("spawn")
+    )
+    atexit.register(executor.shutdown)
+    return executor
+
+def http_client() -> httpx.AsyncClient:
+    """Create an HTTP/2 client whose pooled connections are shared by all page fetches."""
+    # The transport retries failed connection attempts, status retries are handled in fetch_page
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+        retries=FETCH_RETRIES
+    )
+    return httpx.AsyncClient(
+        transport=transport,
+        headers={"User-Agent": USER_AGENT},
+        timeout=15,
+        follow_redirects=True
+    )
+
+async def fetch_page(client, url: str) -> bytes:
+    """Fetch a page over plain HTTP, returning None if the request fails."""
+    cache_key = page_cache_key("http", url)
+    cached = page_cache.get(cache_key)
+    if cached is not None and time.time() - cached["fetched_at"] < PAGE_CACHE_TTL:
+        return cached["html"]
+    
+    # Ask the server to skip the body if the page hasn't changed since it was cached
+    headers = {}
+    if cached is not None:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
     
     try:
-        print("Setting up browser...")
-        driver = setup_driver()
-        wait_for_page_load(driver, url)
-        
-        # Wait for content to load
-        print("Waiting for content to load...")
-        
-        # Try source-specific content selectors first
-        content = ""
-        for selector in source_config["content_selectors"]:
-            try:
-                elements = driver.find_elements(By.CSS_SELECTOR, selector)
-                if elements:
-                    content += "\n".join(element.text for element in elements if element.text.strip())
-            except Exception:
-                continue
-        
-        # If no content found, try common fallback selectors
-        if not content:
-            fallback_selectors = ["article", "main", ".content", "#content"]
-            for selector in fallback_selectors:
-                try:
-                    elements = driver.find_elements(By.CSS_SELECTOR, selector)
-                    if elements:
-                        content += "\n".join(element.text for element in elements if element.text.strip())
-                except Exception:
-                    continue
+        for attempt in range(FETCH_RETRIES + 1):
+            response = await client.get(url, headers=headers)
+            if response.status_code not in RETRY_STATUSES or attempt == FETCH_RETRIES:
+                break
+            await asyncio.sleep(FETCH_RETRY_BACKOFF * 2 ** attempt)
         
-        if content:
-            print(f"Found content length: {len(content)} characters")
-            
-            return {
-                "url": url,
-                "title": driver.title,
-                "content": content
-            }
+        if response.status_code == 304 and cached is not None:
+            logger.debug("Not modified since last fetch: %s", url)
+            html = cached["html"]
         else:
-            print("No content found")
-            
+            response.raise_for_status()
+            html = response.content
     except Exception as e:
-        print(f"Error scraping article: {str(e)}")
-    finally:
-        driver.quit()
+        logger.debug("Static fetch failed for %s: %s", url, e)
+        return None
     
-    return None
+    page_cache.set(cache_key, {
+        "html": html,
+        "etag": response.headers.get("ETag", cached and cached["etag"]),
+        "last_modified": response.headers.get("Last-Modified", cached and cached["last_modified"]),
+        "fetched_at": time.time()
+    })
+    return html
 
-def process_and_upload_articles(article_urls: Set[str], source_config: dict):
-    """Process articles and upload them to Pinecone."""
-    print("\nInitializing Pinecone connection...")
-    try:
-        index = pc.Index(index_name)
-        print("Successfully connected to Pinecone index")
-    except Exception as e:
-        print(f"Error connecting to Pinecone: {str(e)}")
-        return
+async def fetch_pages(urls: List[str]) -> List[bytes]:
+    """Fetch several pages concurrently over one pooled client."""
+    async with http_client() as client:
+        return await asyncio.gather(*[fetch_page(client, url) for url in urls])
+
+async def fetch_static_article(client, semaphore, host_semaphore, parse_executor, url: str, source_config: dict) -> Dict:
+    """Fetch an article without starting a browser, parsing it off the event loop."""
+    async with semaphore, host_semaphore:
+        html = await fetch_page(client, url)
+    if html is None:
+        return None
     
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=50
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        parse_executor, parse_static_article, url, html, source_config
     )
+
+async def fetch_static_articles(urls: List[str], source_config: dict) -> Dict[str, Dict]:
+    """Fetch all articles concurrently, mapping each URL to its article or None."""
+    semaphore = asyncio.Semaphore(STATIC_FETCH_CONCURRENCY)
+    # None runs the parsing on the event loop's default thread pool
+    parse_executor = get_parse_executor() if len(urls) >= PARSE_PROCESS_MIN_PAGES else None
+    # Stay polite to each site while fetching from different sites in parallel
+    host_semaphores = defaultdict(lambda: asyncio.Semaphore(STATIC_FETCH_PER_HOST))
+    # Requests to the same host are multiplexed over one HTTP/2 connection
+    async with http_client() as client:
+        results = await asyncio.gather(
+            *[
+                fetch_static_article(
+                    client, semaphore, host_semaphores[urlparse(url).netloc], parse_executor, url, source_config
+                )
+                for url in urls
+            ],
+            return_exceptions=True
+        )
     
-    batch = []
-    for url in article_urls:
-        article = scrape_article(url, source_config)
-        if article and article["content"]:
-            print(f"\nProcessing article: {article['title']}")
-            
-            # Split content into chunks
-            chunks = text_splitter.split_text(article["content"])
-            print(f"Split into {len(chunks)} chunks")
-            
-            # Create embeddings for each chunk
-            for i, chunk in enumerate(chunks):
-                try:
-                    print(f"Creating embedding for chunk {i+1}/{len(chunks)}")
-                    embedding = embeddings.embed_query(chunk)
-                    
-                    batch.append({
-                        "id": f"{url}-{i}",
-                        "values": embedding,
-                        "metadata": {
-                            "url": url,
-                            "title": article["title"],
-                            "chunk_index": i,
-                            "total_chunks": len(chunks),
-                            "text": chunk,
-                            "source": urlparse(url).netloc
-                        }
-                    })
-                    
-                except Exception as e:
-                    print(f"Error creating embedding: {str(e)}")
-                    continue
+    articles = {}
+    for url, result in zip(urls, results):
+        if isinstance(result, Exception):
+            logger.error("Error parsing article %s: %s", url, result)
+            result = None
+        articles[url] = result
+    return articles
+
+def render_page(driver, url: str, source_config: dict) -> str:
+    """Load a page in the browser and return its rendered HTML."""
+    wait_for_page_load(driver, url, ", ".join(source_config["content_selectors"]))
+    # Transfer the rendered page once and extract everything locally
+    return driver.page_source
+
+def parse_rendered_article(url: str, html: str, source_config: dict) -> Dict:
+    """Extract an article from browser-rendered HTML, returning None if it has no content."""
+    tree = parse_html(html)
+    
+    # Try source-specific content selectors first, then common fallbacks
+    content = extract_text(tree, source_config["content_selectors"])
+    if not content:
+        content = extract_text(tree, FALLBACK_CONTENT_SELECTORS)
+    
+    if not content:
+        logger.warning("No content found for %s", url)
+        return None
     
-    if batch and not MOCK_UPLOAD:
+    logger.debug("Found content length: %d characters", len(content))
+    return {
+        "url": url,
+        "title": (tree.findtext(".//title") or "").strip(),
+        "content": content
+    }
+
+def scrape_article(url: str, source_config: dict) -> Dict:
+    """Scrape a single article page using the current worker thread's browser."""
+    cache_key = page_cache_key("rendered", url)
+    html = page_cache.get(cache_key)
+    rendered = False
+    if html is None:
         try:
-            print(f"\nUploading {len(batch)} vectors to Pinecone...")
-            index.upsert(vectors=batch)
-            print("Successfully uploaded vectors")
+            html = render_page(get_driver(), url, source_config)
+            rendered = True
+        except WebDriverException as e:
+            # The browser may be left in a broken state, replace it for the next page
+            logger.error("Browser error scraping article %s: %s", url, e)
+            discard_driver()
+            return None
         except Exception as e:
-            print(f"Error uploading to Pinecone: {str(e)}")
-    else:
-        print("\nMock mode: No vectors uploaded" if MOCK_UPLOAD else "No vectors to upload - no content was successfully processed")
+            logger.error("Error scraping article %s: %s", url, e)
+            return None
+    
+    article = parse_rendered_article(url, html, source_config)
+    # Only store fresh renders, rewriting a cache hit would push its expiry back on every run
+    if rendered and article:
+        page_cache.set(cache_key, html, expire=PAGE_CACHE_TTL)
+    return article
+
+def article_records(url: str, article: Dict):
+    """Split an article into (url, title, chunk_index, total_chunks, text) records."""
+    # Never index empty chunks, qa_bot relies on every stored chunk having text
+    text_chunks = [chunk for chunk in split_text(article["content"]) if chunk.strip()]
+    logger.info("Processed article: %s (%d chunks)", article["title"], len(text_chunks))
+    for i, chunk in enumerate(text_chunks):
+        yield (url, article["title"], i, len(text_chunks), chunk)
 
-def main():
+def iter_article_records(article_urls: Iterable[str], source_config: dict):
+    """Scrape articles and yield (url, title, chunk_index, total_chunks, text) records."""
+    urls = list(article_urls)
+    
+    if source_config["requires_js"]:
+        yield from iter_rendered_article_records(urls, source_config)
+        return
+    
+    # Server-rendered pages are fetched concurrently over plain HTTP, without starting a browser
+    static_articles = asyncio.run(fetch_static_articles(urls, source_config))
+    dynamic_urls = []
+    for url in urls:
+        # Drop each article once it is chunked so its text is not held until the whole source is done
+        article = static_articles.pop(url)
+        if article:
+            logger.debug("Found static content length for %s: %d characters", url, len(article["content"]))
+            yield from article_records(url, article)
+        else:
+            dynamic_urls.append(url)
+    
+    # Pages that are blocked or rendered client-side still get a browser
+    if dynamic_urls:
+        logger.info("No static content found for %d articles, falling back to browser rendering", len(dynamic_urls))
+        yield from iter_rendered_article_records(dynamic_urls, source_config)
+
+def iter_rendered_article_records(urls: List[str], source_config: dict):
+    """Render articles in a browser and yield their chunk records as they complete."""
+    # Pages are rendered in parallel, the browsers stay open for the next source and are closed at exit
+    executor = get_scrape_executor()
+    futures = {executor.submit(scrape_article, url, source_config): url for url in urls}
+    try:
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                article = future.result()
+            except Exception as e:
+                logger.error("Error loading article %s: %s", url, e)
+                continue
+            if article and article["content"]:
+                yield from article_records(url, article)
+    finally:
+        # Don't render pages nobody will read if the pipeline stops early
+        for future in futures:
+            future.cancel()
+
+def batch_by_tokens(records: Iterable[tuple], max_tokens: int = MAX_EMBED_TOKENS_PER_BATCH, max_items: int = EMBED_BATCH_SIZE):
+    """Group chunk records into batches that stay under both the token and item limits."""
+    batch = []
+    batch_tokens = 0
+    for record in records:
+        tokens = len(tokenizer.encode(record[-1], disallowed_special=()))
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_items):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(record)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def iter_vectors(records: Iterable[tuple]):
+    """Embed chunk records in batches and yield Pinecone vectors one at a time."""
+    # Each batch is embedded as soon as it fills, while the remaining articles are still scraped
+    embedded = 0
+    for batch_records in batch_by_tokens(records):
+        try:
+            logger.debug("Creating embeddings for chunks %d-%d", embedded + 1, embedded + len(batch_records))
+            vectors = embed_with_cache([record[-1] for record in batch_records])
+        except Exception as e:
+            logger.error("Error creating embeddings: %s", e)
+            continue
+        finally:
+            embedded += len(batch_records)
+        
+        for (url, title, i, total_chunks, chunk), embedding in zip(batch_records, vectors):
+            yield {
+                "id": f"{url}-{i}",
+                "values": embedding,
+                "metadata": {
+                    "url": url,
+                    "title": title,
+                    "chunk_index": i,
+                    "total_chunks": total_chunks,
+                    "text": truncate_utf8(chunk, MAX_METADATA_TEXT_BYTES),
+                    "source": urlparse(url).netloc,
+                    "category": article_category(url)
+                }
+            }
+
+def process_and_upload_articles(article_urls: Iterable[str], source_config: dict):
+    """Process articles and upload them to Pinecone."""
+    # Scraping, embedding and uploading run as one lazy pipeline so only a few batches are held in memory
+    upload_records(iter_article_records(article_urls, source_config))
+
+def upload_records(records: Iterable[tuple]):
+    """Embed chunk records and upload their vectors to Pinecone."""
+    vectors = iter_vectors(records)
+    if MOCK_UPLOAD:
+        logger.info("Mock mode: %d vectors created, none uploaded", sum(1 for _ in vectors))
+        return
+    
+    try:
+        logger.info("Uploading vectors to Pinecone...")
+        uploaded = 0
+        index = get_index()
+        pending = deque()
+        for vectors_chunk in chunks(vectors, UPSERT_BATCH_SIZE):
+            # Wait for the oldest request once the in-flight limit is reached
+            if len(pending) >= UPSERT_MAX_IN_FLIGHT:
+                pending.popleft().result()
+            pending.append(index.upsert(vectors=vectors_chunk, async_req=True))
+            uploaded += len(vectors_chunk)
+        
+        # Wait for the remaining requests to surface any errors
+        while pending:
+            pending.popleft().result()
+        
+        if uploaded:
+            logger.info("Successfully uploaded %d vectors", uploaded)
+        else:
+            logger.warning("No vectors to upload - no content was successfully processed")
+    except Exception as e:
+        logger.error("Error uploading to Pinecone: %s", e)
+
+def main(batch_mode: bool = False):
     """Main function to process all sources."""
-    all_articles = set()
-    
-    for source_name, config in SOURCES.items():
-        print(f"\n=== Processing {source_name.upper()} ===")
-        for base_url in config["base_urls"]:
-            articles = get_article_urls(config, base_url)
-            if articles:
-                all_articles.update(articles)
+    all_articles = {}
+    # In batch mode every chunk is scraped first so one embedding batch can be submitted for all of them
+    scraped_records = []
+    
+    # Collect the article links of every base page up front, the results keep the SOURCES order
+    base_pages = [(config, base_url) for config in SOURCES.values() for base_url in config["base_urls"]]
+    harvested = harvest_article_urls(base_pages)
+    
+    for (config, base_url), articles in zip(base_pages, harvested):
+        if articles:
+            logger.info("=== Processing %s ===", base_url)
+            all_articles.update(articles)
+            if batch_mode:
+                scraped_records.extend(iter_article_records(articles, config))
+            else:
                 process_and_upload_articles(articles, config)
     
-    print(f"\nTotal unique article URLs collected: {len(all_articles)}")
+    if batch_mode and scraped_records:
+        # The vectors land in the embedding cache, so uploading no longer calls the embeddings endpoint
+        embed_with_batch_api(record[-1] for record in scraped_records)
+        upload_records(scraped_records)
+    
+    logger.info("Total unique article URLs collected: %d", len(all_articles))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Scrape insurance articles and upload them to Pinecone.")
+    parser.add_argument(
+        "--batch-mode",
+        action="store_true",
+        help="embed with the OpenAI Batch API, cheaper but can take up to 24 hours"
+    )
+    args = parser.parse_args()
+    main(batch_mode=args.batch_mode)
\ No newline at end of file
@@ -1,33 +1,70 @@
-from langchain.chains import ConversationalRetrievalChain, LLMChain
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain.memory import ConversationBufferMemory
 from langchain.prompts import PromptTemplate
 from langchain.schema import Document
+from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 from langchain.chains.qa_with_sources import load_qa_with_sources_chain
 from dotenv import load_dotenv
-import pinecone
+from typing import Dict, List, Optional
+from pinecone.grpc import PineconeGRPC
+import openai
+import httpx
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import os
+import re
+import logging
 
 # Load environment variables
 load_dotenv()
 
+# Retrieved documents are logged at DEBUG level
+logger = logging.getLogger(__name__)
+
 # Initialize Pinecone
-pc = pinecone.Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-index = pc.Index("insurance-articles")
+# Queries from concurrent app sessions are multiplexed over the client's single gRPC channel
+pc = PineconeGRPC(api_key=os.getenv("PINECONE_API_KEY"))
+# A known host lets the client connect without a describe_index round trip
+PINECONE_INDEX_HOST = os.getenv("PINECONE_INDEX_HOST")
+if PINECONE_INDEX_HOST:
+    index = pc.Index(host=PINECONE_INDEX_HOST)
+else:
+    index = pc.Index("insurance-articles")
+
+# Chat and embedding requests share one pool of keep-alive HTTP/2 connections to OpenAI,
+# the async client gets its own pool since httpx clients can't be shared across the two
+OPENAI_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32)
+OPENAI_HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+openai_client = openai.OpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=httpx.Client(http2=True, limits=OPENAI_HTTP_LIMITS, timeout=OPENAI_HTTP_TIMEOUT)
+)
+async_openai_client = openai.AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=httpx.AsyncClient(http2=True, limits=OPENAI_HTTP_LIMITS, timeout=OPENAI_HTTP_TIMEOUT)
+)
 
 # Initialize OpenAI
 llm = ChatOpenAI(
     openai_api_key=os.getenv("OPENAI_API_KEY"),
     model_name="gpt-4-1106-preview",
-    temperature=0.7
+    temperature=0.7,
+    client=openai_client.chat.completions,
+    async_client=async_openai_client.chat.completions
 )
 
-# Initialize embeddings
-embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+# Initialize embeddings (must match the model used in ingest.py)
+EMBEDDING_MODEL = "text-embedding-3-small"
+embeddings = OpenAIEmbeddings(
+    model=EMBEDDING_MODEL,
+    openai_api_key=os.getenv("OPENAI_API_KEY"),
+    client=openai_client.embeddings,
+    async_client=async_openai_client.embeddings
+)
 
-# Create Pinecone as a vector store
-from langchain.vectorstores import Pinecone
-vectorstore = Pinecone(index, embeddings.embed_query, "text")
+# Metadata field holding each chunk's text (must match the field written by ingest.py)
+TEXT_KEY = "text"
 
 # Set up the prompt template for combining documents
 COMBINE_PROMPT_TEMPLATE = """Given the following extracted parts of articles about insurance and a question, create a comprehensive answer with citations.
@@ -54,66 +91,278 @@ combine_prompt = PromptTemplate(
     input_variables=["summaries", "question"]
 )
 
+# Create the QA chain with the correct prompt once, it holds no per-question state
+QA_CHAIN = load_qa_with_sources_chain(
+    llm=llm,
+    chain_type="stuff",
+    prompt=combine_prompt
+)
+
+# Streaming model for the REPL, built explicitly because copy() drops the excluded client and callbacks fields
+streaming_llm = ChatOpenAI(
+    openai_api_key=os.getenv("OPENAI_API_KEY"),
+    model_name="gpt-4-1106-preview",
+    temperature=0.7,
+    streaming=True,
+    client=openai_client.chat.completions,
+    async_client=async_openai_client.chat.completions
+)
+
+# Same chain with the streaming model, which passes each token to the callbacks given at call time
+STREAMING_QA_CHAIN = load_qa_with_sources_chain(
+    llm=streaming_llm,
+    chain_type="stuff",
+    prompt=combine_prompt
+)
+
+def check_streaming_chain():
+    """Fail early if the streaming chain's model is missing anything it needs to be called."""
+    chain_llm = STREAMING_QA_CHAIN.llm_chain.llm
+    missing = [field for field in ("client", "async_client", "callbacks") if not hasattr(chain_llm, field)]
+    if missing or chain_llm.client is None or not chain_llm.streaming:
+        raise RuntimeError(f"Streaming QA chain is not usable, missing: {', '.join(missing) or 'streaming client'}")
+
+NO_DOCUMENTS_ANSWER = "I couldn't find any relevant information in my knowledge base to answer your question."
+
+# Number of question embeddings kept in memory, about 6KB each
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+
+# Insurance lines stored as article metadata by ingest.py, a question naming some of them
+# only searches those lines' articles (must match the categories in ingest.py)
+# Terms shared between lines, like "property" in property damage liability, are left out
+# since a question matching them is filtered away from the other line's articles
+CATEGORY_PATTERNS = {
+    "auto": re.compile(r"\b(?:car|cars|auto|automobile|vehicles?|drivers?|driving|motorcycles?|trucks?)\b", re.IGNORECASE),
+    "home": re.compile(r"\b(?:home|homes|homeowners?|house|renters?|condos?)\b", re.IGNORECASE),
+    "life": re.compile(r"\blife\b", re.IGNORECASE)
+}
+# Articles whose URL names no insurance line, always searched alongside the question's line
+GENERAL_CATEGORY = "general"
+
+# Questions comparing several insurance lines retrieve each line's articles concurrently
+retrieval_executor = ThreadPoolExecutor(max_workers=len(CATEGORY_PATTERNS))
+
+# Pause in typing after which the REPL embeds the partial question in the background, on its
+# own threads so submitting a question never waits for a stale prefetch to finish
+PREFETCH_DEBOUNCE = 0.3  # seconds
+prefetch_executor = ThreadPoolExecutor(max_workers=2)
+
+# Number of questions embedded per request by get_answers
+RAG_EMBEDDING_OPENAI_BATCH_SIZE = int(os.getenv("RAG_EMBEDDING_OPENAI_BATCH_SIZE", "16"))
+
+def normalize_question(question: str) -> str:
+    """Normalize case and whitespace so repeated questions share one embedding."""
+    return " ".join(question.lower().split())
+
+@functools.lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)
+def embed_question(normalized_question: str) -> np.ndarray:
+    """Embed a normalized question, reusing the vector for repeated questions."""
+    vector = np.asarray(embeddings.embed_query(normalized_question), dtype=np.float32)
+    # The cached array is shared between callers, so it must not be modified
+    vector.flags.writeable = False
+    return vector
+
+def question_categories(question: str) -> List[str]:
+    """Return the insurance lines a question is about."""
+    return [category for category, pattern in CATEGORY_PATTERNS.items() if pattern.search(question)]
+
+def query_index(vector: List[float], k: int, filter: Optional[Dict] = None) -> List:
+    """Query Pinecone and return the matches with their metadata and scores."""
+    return index.query(vector=vector, top_k=k, include_metadata=True, filter=filter).matches
+
+def best_match_per_url(matches: List) -> List:
+    """Keep only the highest-scoring match of each article, best match first."""
+    # Several chunks of one article would mostly repeat each other in the prompt
+    best = {}
+    for match in matches:
+        url = match.metadata.get("url")
+        if url not in best or match.score > best[url].score:
+            best[url] = match
+    return sorted(best.values(), key=lambda match: match.score, reverse=True)
+
+def match_documents(matches: List) -> List[Document]:
+    """Build the documents passed to the QA chain, with the source metadata it cites."""
+    docs = []
+    for match in matches:
+        if TEXT_KEY not in match.metadata:
+            logger.warning("Found document with no `%s` key. Skipping.", TEXT_KEY)
+            continue
+        docs.append(Document(
+            page_content=match.metadata[TEXT_KEY],
+            metadata={
+                'source': match.metadata.get('url', 'No URL'),
+                'title': match.metadata.get('title', 'No Title')
+            }
+        ))
+    return docs
+
+def search_documents(embedding: np.ndarray, categories: List[str] = (), k: int = 3) -> List[Document]:
+    """Return the chunks closest to a question embedding, k from each of the given categories."""
+    vector = embedding.tolist()
+    # Pre-filtering narrows each search to one insurance line, so a question comparing lines
+    # gets articles about each of them instead of whichever line dominates the embedding
+    filters = [{"category": {"$in": [category, GENERAL_CATEGORY]}} for category in categories]
+    if len(filters) == 1:
+        matches = query_index(vector, k, filter=filters[0])
+    else:
+        # Retrieval takes as long as the slowest query rather than the sum of them
+        matches = [
+            match
+            for category_matches in retrieval_executor.map(lambda f: query_index(vector, k, filter=f), filters)
+            for match in category_matches
+        ]
+    # Vectors ingested before categories were stored have none, so fall back to the whole index
+    if not matches:
+        matches = query_index(vector, k)
+    # Documents are only built for the matches that reach the prompt
+    return match_documents(best_match_per_url(matches))
+
+def retrieve_documents(question: str, k: int = 3) -> List[Document]:
+    """Return the k chunks closest to the question."""
+    return search_documents(embed_question(normalize_question(question)), question_categories(question), k=k)
+
+def log_documents(docs: List[Document]):
+    """Log the retrieved documents before they are passed to the QA chain."""
+    # Skip building the previews entirely unless debug output is enabled
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Retrieved %d documents:\n%s", len(docs), "\n".join(
+            f"{i}. {doc.metadata['title']} ({doc.metadata['source']}): {doc.page_content[:200]}"
+            for i, doc in enumerate(docs, 1)
+        ))
+
+def qa_chain_inputs(question: str, docs: List[Document]) -> Dict:
+    """Build the QA chain inputs for a question and its retrieved documents."""
+    # The chain fills {summaries} itself from the documents, with the source of each one
+    return {"input_documents": docs, "question": question}
+
+def answer_question(question: str) -> str:
+    """Get an answer from the QA system, raising on retrieval or LLM errors."""
+    # Get relevant documents first
+    return answer_from_documents(question, retrieve_documents(question))
+
+def answer_from_documents(question: str, docs: List[Document]) -> str:
+    """Answer a question from its retrieved documents."""
+    # Ingestion never stores empty chunks, so every retrieved document has content
+    log_documents(docs)
+    if not docs:
+        return NO_DOCUMENTS_ANSWER
+    
+    # Get the answer using the retrieved documents
+    result = QA_CHAIN(qa_chain_inputs(question, docs), return_only_outputs=True)
+    return result["output_text"]
+
+def stream_answer(question: str) -> str:
+    """Answer a question, printing the answer to stdout token by token as it is generated."""
+    docs = retrieve_documents(question)
+    log_documents(docs)
+    if not docs:
+        print(NO_DOCUMENTS_ANSWER)
+        return NO_DOCUMENTS_ANSWER
+    
+    result = STREAMING_QA_CHAIN(
+        qa_chain_inputs(question, docs),
+        callbacks=[StreamingStdOutCallbackHandler()],
+        return_only_outputs=True
+    )
+    return result["output_text"]
+
+async def aanswer_question(question: str) -> str:
+    """Async version of answer_question, so concurrent questions overlap their network calls."""
+    # The answer needs the documents, so retrieval is awaited while other questions make progress,
+    # it runs in a thread so embedding and query share the cache used by answer_question
+    loop = asyncio.get_running_loop()
+    docs = await loop.run_in_executor(None, retrieve_documents, question)
+    log_documents(docs)
+    if not docs:
+        return NO_DOCUMENTS_ANSWER
+    
+    result = await QA_CHAIN.acall(qa_chain_inputs(question, docs), return_only_outputs=True)
+    return result["output_text"]
+
 def get_answer(question: str) -> str:
     """Get an answer from the QA system."""
     try:
-        # Get relevant documents first
-        docs = vectorstore.similarity_search(question, k=3)
-        print("\nRetrieved Documents:")
-        for i, doc in enumerate(docs, 1):
-            print(f"\nDocument {i}:")
-            print(f"Source: {doc.metadata.get('url', 'No URL')}")
-            print(f"Title: {doc.metadata.get('title', 'No Title')}")
-            print(f"Content Preview: {doc.page_content[:200] if doc.page_content else 'No content'}")
-        
-        # Format documents for better source tracking
-        formatted_docs = []
-        for doc in docs:
-            if doc.page_content:
-                # Create document with required source metadata
-                formatted_docs.append(Document(
-                    page_content=doc.metadata.get('text', doc.page_content),
-                    metadata={
-                        'source': doc.metadata.get('url', 'No URL'),
-                        'title': doc.metadata.get('title', 'No Title')
-                    }
-                ))
-        
-        if not formatted_docs:
-            return "I couldn't find any relevant information in my knowledge base to answer your question."
-        
-        # Create a QA chain with the correct prompt
-        qa_chain = load_qa_with_sources_chain(
-            llm=llm,
-            chain_type="stuff",
-            prompt=combine_prompt
-        )
-        
-        # Combine all document content
-        summaries = "\n\n".join(doc.page_content for doc in formatted_docs)
-        
-        # Get the answer using the formatted documents
-        result = qa_chain(
-            {"input_documents": formatted_docs, "question": question, "summaries": summaries},
-            return_only_outputs=True
-        )
-        
-        return result["output_text"]
+        return answer_question(question)
+    except Exception as e:
+        return f"Error getting answer: {str(e)}"
+
+def get_answers(questions: List[str]) -> List[str]:
+    """Get answers for several questions, embedding the questions in batched requests."""
+    normalized = list(dict.fromkeys(normalize_question(question) for question in questions))
+    try:
+        vectors = {}
+        for start in range(0, len(normalized), RAG_EMBEDDING_OPENAI_BATCH_SIZE):
+            batch = normalized[start:start + RAG_EMBEDDING_OPENAI_BATCH_SIZE]
+            batch_vectors = np.asarray(embeddings.embed_documents(batch), dtype=np.float32)
+            vectors.update(zip(batch, batch_vectors))
+    except Exception as e:
+        return [f"Error getting answer: {str(e)}"] * len(questions)
+    
+    answers = []
+    for question in questions:
+        try:
+            docs = search_documents(vectors[normalize_question(question)], question_categories(question))
+            answers.append(answer_from_documents(question, docs))
+        except Exception as e:
+            answers.append(f"Error getting answer: {str(e)}")
+    return answers
+
+async def aget_answer(question: str) -> str:
+    """Get an answer from the QA system without blocking the event loop."""
+    try:
+        return await aanswer_question(question)
     except Exception as e:
         return f"Error getting answer: {str(e)}"
 
+def prefetch_question_embedding(text: str):
+    """Embed a partially typed question in the background so the final lookup is a cache hit."""
+    normalized = normalize_question(text)
+    if not normalized:
+        return
+    try:
+        embed_question(normalized)
+    except Exception:
+        # A failed prefetch only means the question is embedded when it is submitted
+        pass
+
 def main():
+    # Only the REPL needs prompt_toolkit, the app imports this module without it
+    from prompt_toolkit import PromptSession
+    
+    # Every answer goes through the streaming chain, so refuse to start if it can't be called
+    check_streaming_chain()
+    
     print("Insurance QA Bot (type 'quit' to exit)")
     print("--------------------------------------")
     
+    # Embed the question whenever the user pauses typing, while they are still deciding to submit
+    session = PromptSession()
+    pending_prefetch = None
+    
+    def schedule_prefetch(buffer):
+        nonlocal pending_prefetch
+        if pending_prefetch is not None:
+            pending_prefetch.cancel()
+        loop = asyncio.get_running_loop()
+        pending_prefetch = loop.call_later(
+            PREFETCH_DEBOUNCE, prefetch_executor.submit, prefetch_question_embedding, buffer.text
+        )
+    
+    session.default_buffer.on_text_changed += schedule_prefetch
+    
     while True:
-        question = input("\nYour question: ").strip()
+        question = session.prompt("\nYour question: ").strip()
         if question.lower() in ['quit', 'exit']:
             break
             
         if question:
-            answer = get_answer(question)
-            print("\nAnswer:", answer)
+            # Print the answer as it streams in rather than after the whole generation
+            print("\nAnswer: ", end="", flush=True)
+            try:
+                stream_answer(question)
+            except Exception as e:
+                print(f"Error getting answer: {str(e)}", end="")
+            print()
 
 if __name__ == "__main__":
     main()